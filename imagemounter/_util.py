@@ -1,8 +1,10 @@
+import functools
 import logging
 import time
 import subprocess
 import re
 import glob
+import shutil
 import os
 import sys
 import locale
@@ -12,6 +14,14 @@ from imagemounter.exceptions import SubsystemError, CleanupError, NoNetworkBlock
 logger = logging.getLogger(__name__)
 encoding = locale.getdefaultlocale()[1]
 
+ENCASE_RE = re.compile(r'^.*\.[Ee][Xx]?\d\d$')
+AFF_RE = re.compile(r'^.*\.[Aa][Ff][FfDdMm]$')
+COMPRESSED_RE = re.compile(r'^.*\.((zip)|(rar)|((t(ar\.)?)?gz))$')
+VMWARE_RE = re.compile(r'^.*\.vmdk')
+QCOW2_RE = re.compile(r'.*\.qcow2')
+VBOX_RE = re.compile(r'.*\.vdi')
+SEGMENT_EXT_RE = re.compile(r'^.*\.(\d{2,})$')
+
 
 def clean_unmount(cmd, mountpoint, tries=5, rmdir=True):
     cmd.append(mountpoint)
@@ -27,17 +37,19 @@ def clean_unmount(cmd, mountpoint, tries=5, rmdir=True):
         pass  # if is not a mount point, we can simply skip to removing it
     else:
         # Perform unmount
-        # noinspection PyBroadException
         try:
             check_call_(cmd)
-        except Exception as e:
+        except (subprocess.CalledProcessError, OSError) as e:
             raise SubsystemError(e)
 
     # Remove mountpoint only if needed
     if not rmdir:
         return
 
-    for _ in range(tries):
+    # Most unmounts settle within a few tenths of a second, so check often at first. Slow FUSE unmounts may take
+    # seconds, so keep waiting for at least as long as *tries* one-second intervals would.
+    waited, delay = 0, 0.1
+    while True:
         if not os.path.ismount(mountpoint):
             # Unmount was successful, remove mountpoint
             try:
@@ -48,31 +60,38 @@ def clean_unmount(cmd, mountpoint, tries=5, rmdir=True):
             except FileNotFoundError:
                 pass  # this is what we are looking for!
             break
-        else:
-            time.sleep(1)
+        elif waited >= tries:
+            break
+        time.sleep(delay)
+        waited += delay
+        delay = min(delay * 2, 1)
 
     if os.path.isdir(mountpoint):
         raise CleanupError()
 
 
 def is_encase(path):
-    return re.match(r'^.*\.[Ee][Xx]?\d\d$', path)
+    return ENCASE_RE.match(path)
+
+
+def is_aff(path):
+    return AFF_RE.match(path)
 
 
 def is_compressed(path):
-    return re.match(r'^.*\.((zip)|(rar)|((t(ar\.)?)?gz))$', path)
+    return COMPRESSED_RE.match(path)
 
 
 def is_vmware(path):
-    return re.match(r'^.*\.vmdk', path)
+    return VMWARE_RE.match(path)
 
 
 def is_qcow2(path):
-    return re.match(r'.*\.qcow2', path)
+    return QCOW2_RE.match(path)
 
 
 def is_vbox(path):
-    return re.match(r'.*\.vdi', path)
+    return VBOX_RE.match(path)
 
 
 def expand_path(path):
@@ -85,7 +104,7 @@ def expand_path(path):
     """
     if is_encase(path):
         return glob.glob(path[:-2] + '??') or [path]
-    ext_match = re.match(r'^.*\.(\d{2,})$', path)
+    ext_match = SEGMENT_EXT_RE.match(path)
     if ext_match is not None:
         ext_size = len(ext_match.groups()[-1])
         return glob.glob(path[:-ext_size] + '[0-9]' * ext_size) or [path]
@@ -93,18 +112,10 @@ def expand_path(path):
         return [path]
 
 
+# the tools do not appear or disappear while imagemounter runs
+@functools.lru_cache(maxsize=None)
 def command_exists(cmd):
-    fpath, fname = os.path.split(cmd)
-    if fpath:
-        return os.path.isfile(cmd) and os.access(cmd, os.X_OK)
-    else:
-        for p in os.environ['PATH'].split(os.pathsep):
-            p = p.strip('"')
-            fp = os.path.join(p, cmd)
-            if os.path.isfile(fp) and os.access(fp, os.X_OK):
-                return True
-
-    return False
+    return shutil.which(cmd) is not None
 
 
 def module_exists(mod):
@@ -117,7 +128,8 @@ def module_exists(mod):
 
 
 def check_call_(cmd, wrap_error=False, *args, **kwargs):
-    logger.debug('$ {0}'.format(' '.join(cmd)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('$ %s', ' '.join(cmd))
     try:
         return subprocess.check_call(cmd, *args, **kwargs)
     except Exception as e:
@@ -128,18 +140,19 @@ def check_call_(cmd, wrap_error=False, *args, **kwargs):
 
 
 def check_output_(cmd, *args, **kwargs):
-    logger.debug('$ {0}'.format(' '.join(cmd)))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('$ %s', ' '.join(cmd))
     try:
         result = subprocess.check_output(cmd, *args, **kwargs)
         if result:
-            result = result.decode(encoding)
-            logger.debug('< {0}'.format(result))
+            result = result.decode(encoding, errors='replace')
+            logger.debug('< %s', result)
         return result
     except subprocess.CalledProcessError as e:
-        logger.debug("< return code {}".format(e.returncode))
+        logger.debug("< return code %s", e.returncode)
         if e.output:
-            result = e.output.decode(encoding)
-            logger.debug('< {0}'.format(result))
+            result = e.output.decode(encoding, errors='replace')
+            logger.debug('< %s', result)
         raise
 
 
@@ -150,8 +163,8 @@ def get_free_nbd_device():
                 return "/dev/{}".format(os.path.basename(nbd_path))
         except subprocess.CalledProcessError as e:
             if e.output:
-                result = e.output.decode(encoding)
-                logger.debug("< {0}".format(result))
+                result = e.output.decode(encoding, errors='replace')
+                logger.debug("< %s", result)
     raise NoNetworkBlockAvailableError()
 
 
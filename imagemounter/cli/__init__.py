@@ -31,7 +31,8 @@ class AppendDictAction(argparse.Action):
         super(AppendDictAction, self).__init__(*args, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None):
-        items = getattr(namespace, self.dest, {}) or {}
+        # copy, as the current value may be the default, which is shared between parses
+        items = dict(getattr(namespace, self.dest, {}) or {})
         if ',' not in values and '=' not in values:
             items['*'] = values
         else:
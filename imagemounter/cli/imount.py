@@ -4,6 +4,8 @@
 #
 
 import argparse
+import concurrent.futures
+import functools
 import glob
 import logging
 import sys
@@ -15,12 +17,16 @@ from imagemounter.cli import CheckAction, get_coloring_func, AppendDictAction, I
 from imagemounter.exceptions import NoRootFoundError, ImageMounterError, UnsupportedFilesystemError
 
 
-def main():
-    class MyParser(argparse.ArgumentParser):
-        def error(self, message):
-            sys.stderr.write('error: {0}\n'.format(message))
-            self.print_help()
-            sys.exit(2)
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: {0}\n'.format(message))
+        self.print_help()
+        sys.exit(2)
+
+
+@functools.lru_cache(maxsize=1)
+def _build_parser():
+    """Builds the argument parser of imount. It is only built once, as it does not depend on any state."""
 
     parser = MyParser(description='Utility to mount volumes in Encase and dd images locally.')
     parser.add_argument('images', nargs='*',
@@ -104,6 +110,11 @@ def main():
     toggroup.add_argument('--no-single', action='store_true', default=False,
                           help="prevent trying to mount the image as a single volume if no volume system was found")
 
+    return parser
+
+
+def main():
+    parser = _build_parser()
     args = parser.parse_args()
     col = get_coloring_func(color=args.color, no_color=args.color)
 
@@ -249,16 +260,30 @@ def main():
         p = None
         try:
             p = ImageParser(images, **vars(args))
-            num = 0
 
-            # Mount all disks. We could use .init, but where's the fun in that?
+            def mount_disk(disk):
+                disk.mount()
+                disk.volumes.preload_volume_data()
+
+            # Mount all disks. We could use .init, but where's the fun in that? The base images are independent of
+            # each other and their mount tools mostly wait on I/O, so they are mounted concurrently.
             for disk in p.disks:
-                num += 1
                 print('[+] Mounting image {0} using {1}...'.format(disk.paths[0], disk.disk_mounter))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(len(p.disks), 1)) as executor:
+                futures = [executor.submit(mount_disk, disk) for disk in p.disks]
+                try:
+                    concurrent.futures.wait(futures)
+                except KeyboardInterrupt:
+                    # disks that are still being mounted must be done before they can be cleaned up
+                    for future in futures:
+                        future.cancel()
+                    concurrent.futures.wait(futures)
+                    raise
 
+            for num, (disk, future) in enumerate(zip(p.disks, futures), 1):
                 # Mount the base image using the preferred method
                 try:
-                    disk.mount()
+                    future.result()
                 except ImageMounterError:
                     print(col("[-] Failed mounting base image. Perhaps try another mount method than {0}?"
                               .format(disk.disk_mounter), "red"))
@@ -267,11 +292,9 @@ def main():
                 if args.read_write:
                     print('[+] Created read-write cache at {0}'.format(disk.rwpath))
 
-                disk.volumes.preload_volume_data()
                 print('[+] Mounted raw image [{num}/{total}]'.format(num=num, total=len(args.images)))
 
-            sys.stdout.write("[+] Mounting volume...\r")
-            sys.stdout.flush()
+            print("[+] Mounting volume...", end="\r", flush=True)
             has_left_mounted = False
 
             for volume in p.init_volumes(args.single, args.only_mount, args.skip, swallow_exceptions=True):
@@ -308,8 +331,7 @@ def main():
                                 input(col('>>> Press [enter] to continue... ', attrs=['dark']))
 
                         if args.carve and volume.flag in ('alloc', 'unalloc'):
-                            sys.stdout.write("[+] Carving volume...\r")
-                            sys.stdout.flush()
+                            print("[+] Carving volume...", end="\r", flush=True)
                             try:
                                 path = volume.carve(freespace=False)
                             except ImageMounterError:
@@ -333,8 +355,7 @@ def main():
                             print(col('[-] Could not detect further volumes in the loopback device.', 'red'))
 
                         if args.carve:
-                            sys.stdout.write("[+] Carving volume...\r")
-                            sys.stdout.flush()
+                            print("[+] Carving volume...", end="\r", flush=True)
                             try:
                                 path = volume.carve()
                             except ImageMounterError:
@@ -343,8 +364,7 @@ def main():
                                 print('[+] Carved data is available at {0}.'.format(col(path, 'green', attrs=['bold'])))
 
                         if args.vshadow and volume.filesystem.type == 'ntfs':
-                            sys.stdout.write("[+] Mounting volume shadow copies...\r")
-                            sys.stdout.flush()
+                            print("[+] Mounting volume shadow copies...", end="\r", flush=True)
                             try:
                                 volumes = volume.detect_volume_shadow_copies()
                             except ImageMounterError:
@@ -384,8 +404,7 @@ def main():
                 except KeyboardInterrupt:
                     has_left_mounted = True
                     print("")
-                sys.stdout.write("[+] Mounting volume...\r")
-                sys.stdout.flush()
+                print("[+] Mounting volume...", end="\r", flush=True)
 
             for disk in p.disks:
                 if [x for x in disk.volumes if x.was_mounted] == 0:
@@ -115,16 +115,14 @@ class FileSystemTypeDependency(Dependency):
     def _is_loaded(self):
         """check the filesystem is loaded directly"""
         with open("/proc/filesystems", "r") as f:
-            for l in f:
-                if l.split()[-1] == self.name:
-                    return True
-        return False
+            # lines are either 'name' or 'nodev\tname', so only the last field is relevant
+            return any(line.rsplit(None, 1)[-1] == self.name for line in f if line.strip())
 
     def _is_module(self):
         """check the kernel module exists by executing modinfo and checking for an exception"""
         try:
             _util.check_call_(['modinfo', "fs-" + self.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        except Exception:
+        except (subprocess.CalledProcessError, OSError):
             return False
         else:
             return True
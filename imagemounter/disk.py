@@ -1,10 +1,10 @@
 from collections import defaultdict
 
-import glob
 import logging
 import os
 import subprocess
 import tempfile
+import threading
 import time
 
 from imagemounter import _util, BLOCK_SIZE
@@ -14,6 +14,27 @@ from imagemounter.volume_system import VolumeSystem
 
 logger = logging.getLogger(__name__)
 
+# Files in the mountpoint of a disk mounter that contain the raw disk image, in order of preference
+RAW_PATH_SUFFIXES = ('.dd', '.iso', '.raw', '.dmg')
+RAW_PATH_NAMES = ('ewf1', 'flat', 'avfs')
+
+# Held while looking for a free nbd device and attaching qemu-nbd to it
+_nbd_lock = threading.Lock()
+
+# The mount methods that are tried for each disk type, in order of preference, before falling back to xmount
+DISK_TYPE_MOUNT_METHODS = {
+    'encase': ('ewfmount', ),
+    'vmdk': ('vmware-mount', 'affuse'),
+    'dd': ('affuse', ),
+    'compressed': ('avfs', ),
+    'qcow2': ('qemu-nbd', ),
+    'vdi': ('qemu-nbd', ),
+}
+# The command that must be available for a mount method, if it differs from the name of the method
+MOUNT_METHOD_COMMANDS = {
+    'avfs': 'avfsd',
+}
+
 
 class Disk:
     """Representation of a disk, image file or anything else that can be considered a disk. """
@@ -85,33 +106,20 @@ class Disk:
         """Finds which mount methods are suitable for the specified disk type. Returns a list of all suitable mount
         methods.
         """
-        if self.disk_mounter == 'auto':
-            methods = []
+        if self.disk_mounter != 'auto':
+            return [self.disk_mounter]
 
-            def add_method_if_exists(method):
-                if (method == 'avfs' and _util.command_exists('avfsd')) or \
-                        _util.command_exists(method):
-                    methods.append(method)
-
-            if self.read_write:
-                add_method_if_exists('xmount')
-            else:
-                if disk_type == 'encase':
-                    add_method_if_exists('ewfmount')
-                elif disk_type == 'vmdk':
-                    add_method_if_exists('vmware-mount')
-                    add_method_if_exists('affuse')
-                elif disk_type == 'dd':
-                    add_method_if_exists('affuse')
-                elif disk_type == 'compressed':
-                    add_method_if_exists('avfs')
-                elif disk_type == 'qcow2':
-                    add_method_if_exists('qemu-nbd')
-                elif disk_type == 'vdi':
-                    add_method_if_exists('qemu-nbd')
-                add_method_if_exists('xmount')
+        methods = []
+        if self.read_write:
+            candidates = ('xmount', )
         else:
-            methods = [self.disk_mounter]
+            # a single raw image can be used directly, without the overhead of a FUSE layer
+            if disk_type == 'dd' and len(self.paths) == 1 and not _util.is_aff(self.paths[0]):
+                methods.append('dummy')
+            candidates = DISK_TYPE_MOUNT_METHODS.get(disk_type, ()) + ('xmount', )
+
+        methods.extend(method for method in candidates
+                       if _util.command_exists(MOUNT_METHOD_COMMANDS.get(method, method)))
         return methods
 
     def _mount_avfs(self):
@@ -120,7 +128,7 @@ class Disk:
         self._paths['avfs'] = tempfile.mkdtemp(prefix='image_mounter_avfs_')
 
         # start by calling the mountavfs command to initialize avfs
-        _util.check_call_(['avfsd', self._paths['avfs'], '-o', 'allow_other'], stdout=subprocess.PIPE)
+        _util.check_call_(['avfsd', self._paths['avfs'], '-o', 'allow_other'], stdout=subprocess.DEVNULL)
 
         # no multifile support for avfs
         avfspath = self._paths['avfs'] + '/' + os.path.abspath(self.paths[0]) + '#'
@@ -144,16 +152,32 @@ class Disk:
         """
 
         if self.parser.casename:
-            self.mountpoint = tempfile.mkdtemp(prefix='image_mounter_', suffix='_' + self.parser.casename)
+            self.mountpoint = tempfile.mkdtemp(prefix='image_mounter_', suffix='_{0}'.format(self.parser.casename))
         else:
             self.mountpoint = tempfile.mkdtemp(prefix='image_mounter_')
 
         if self.read_write:
-            self.rwpath = tempfile.mkstemp(prefix="image_mounter_rw_cache_")[1]
+            fd, self.rwpath = tempfile.mkstemp(prefix="image_mounter_rw_cache_")
+            os.close(fd)  # xmount opens the cache itself
 
         disk_type = self.get_disk_type()
         methods = self._get_mount_methods(disk_type)
 
+        if 'qemu-nbd' in methods:
+            # a free nbd device is only claimed once qemu-nbd has attached to it, so other disks that are mounted at
+            # the same time must not look for a free device in the meantime
+            with _nbd_lock:
+                self._mount_using(disk_type, methods)
+        else:
+            self._mount_using(disk_type, methods)
+
+    def _mount_using(self, disk_type, methods):
+        """Tries the given mount methods in order of preference. Internal method, used by :func:`mount`.
+
+        :param str disk_type: the disk type, as returned by :func:`get_disk_type`
+        :param list methods: the mount methods to try
+        """
+
         cmds = []
         for method in methods:
             if method == 'avfs':  # avfs does not participate in the fallback stuff, unfortunately
@@ -206,7 +230,7 @@ class Disk:
         for cmd in cmds:
             # noinspection PyBroadException
             try:
-                _util.check_call_(cmd, stdout=subprocess.PIPE)
+                _util.check_call_(cmd, stdout=subprocess.DEVNULL)
                 # mounting does not seem to be instant, add a timer here
                 time.sleep(.1)
             except Exception:
@@ -237,28 +261,55 @@ class Disk:
 
         if self.disk_mounter == 'dummy':
             return self.paths[0]
+        elif self._paths.get('nbd'):
+            return self._paths['nbd']
+
+        if self.disk_mounter == 'avfs' and os.path.isdir(os.path.join(self.mountpoint, 'avfs')):
+            logger.debug("AVFS mounted as a directory, will look in directory for (random) file.")
+            # there is no support for disks inside disks, so this will fail to work for zips containing
+            # E01 files or so.
+            searchdirs = (os.path.join(self.mountpoint, 'avfs'), self.mountpoint)
         else:
-            if self.disk_mounter == 'avfs' and os.path.isdir(os.path.join(self.mountpoint, 'avfs')):
-                logger.debug("AVFS mounted as a directory, will look in directory for (random) file.")
-                # there is no support for disks inside disks, so this will fail to work for zips containing
-                # E01 files or so.
-                searchdirs = (os.path.join(self.mountpoint, 'avfs'), self.mountpoint)
-            else:
-                searchdirs = (self.mountpoint, )
+            searchdirs = (self.mountpoint, )
+
+        for searchdir in searchdirs:
+            raw_path = self._find_raw_file(searchdir)
+            if raw_path is not None:
+                return raw_path
+
+        logger.warning("No viable mount file found in {}.".format(searchdirs))
+        return None
 
-            raw_path = []
-            if self._paths.get('nbd'):
-                raw_path.append(self._paths['nbd'])
+    @staticmethod
+    def _find_raw_file(searchdir):
+        """Finds the file in the directory that is most likely the raw disk image, by order of preference according
+        to :const:`RAW_PATH_SUFFIXES` and :const:`RAW_PATH_NAMES`. The directory is read only once, and reading stops
+        as soon as a file of the most preferred kind is found.
 
-            for searchdir in searchdirs:
-                # avfs: apparently it is not a dir
-                for pattern in ['*.dd', '*.iso', '*.raw', '*.dmg', 'ewf1', 'flat', 'avfs']:
-                    raw_path.extend(glob.glob(os.path.join(searchdir, pattern)))
+        :return: the path to the file, or None if there is no such file
+        :rtype: str
+        """
 
-            if not raw_path:
-                logger.warning("No viable mount file found in {}.".format(searchdirs))
-                return None
-            return raw_path[0]
+        best_rank, best_path = None, None
+        try:
+            with os.scandir(searchdir) as it:
+                for entry in it:
+                    if entry.name in RAW_PATH_NAMES:
+                        rank = len(RAW_PATH_SUFFIXES) + RAW_PATH_NAMES.index(entry.name)
+                    elif not entry.name.startswith('.') and entry.name.endswith(RAW_PATH_SUFFIXES):
+                        rank = next(i for i, suffix in enumerate(RAW_PATH_SUFFIXES) if entry.name.endswith(suffix))
+                    else:
+                        continue
+
+                    if best_rank is None or rank < best_rank:
+                        best_rank, best_path = rank, entry.path
+                        if rank == 0:
+                            break
+        except OSError:
+            # e.g. the mountpoint is not set or is not a directory
+            return None
+
+        return best_path
 
     def get_fs_path(self):
         """Returns the path to the filesystem. Most of the times this is the image file, but may instead also return
@@ -335,7 +386,13 @@ class Disk:
         :param bool swallow_exceptions: If True, Exceptions are not raised but rather set on the instance.
         """
 
-        for volume in self.detect_volumes(single=single):
+        volumes = list(self.detect_volumes(single=single))
+
+        # start obtaining the data required for mounting for all volumes at once
+        for volume in volumes:
+            volume.prefetch(only_mount=only_mount, skip_mount=skip_mount)
+
+        for volume in volumes:
             yield from volume.init(only_mount=only_mount, skip_mount=skip_mount,
                                    swallow_exceptions=swallow_exceptions)
 
@@ -350,7 +407,12 @@ class Disk:
     def rw_active(self):
         """Indicates whether anything has been written to a read-write cache."""
 
-        return self.rwpath and os.path.getsize(self.rwpath)
+        if not self.rwpath:
+            return False
+        try:
+            return os.stat(self.rwpath).st_size > 0
+        except OSError:
+            return False
 
     def unmount(self, remove_rw=False, allow_lazy=False):
         """Removes all ties of this disk to the filesystem, so the image can be unmounted successfully.
@@ -384,7 +446,12 @@ class Disk:
                     raise
                 _util.clean_unmount(['fusermount', '-uz'], self._paths['avfs'])
 
-        if self.rw_active() and remove_rw:
-            os.remove(self.rwpath)
+        # an empty read-write cache contains nothing worth keeping
+        if self.rwpath and (remove_rw or not self.rw_active()):
+            try:
+                os.remove(self.rwpath)
+            except FileNotFoundError:
+                pass
+            self.rwpath = ""
 
         self.is_mounted = False
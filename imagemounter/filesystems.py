@@ -1,3 +1,6 @@
+import collections
+import contextlib
+import functools
 import inspect
 import logging
 import os
@@ -8,6 +11,7 @@ import subprocess
 import sys
 import tempfile
 import time
+import types
 
 from imagemounter import _util, VOLUME_SYSTEM_TYPES, dependencies
 from imagemounter.exceptions import UnsupportedFilesystemError, IncorrectFilesystemError, ArgumentError, \
@@ -16,6 +20,12 @@ from imagemounter.exceptions import UnsupportedFilesystemError, IncorrectFilesys
 
 logger = logging.getLogger(__name__)
 
+# Options passed to mount to let it set up a loop device for the volume within the raw image
+LOOP_MOUNT_OPTS = 'loop,offset={offset},sizelimit={size}'
+
+# Matches the physical volume and its volume group in the output of pvscan, also when the volume group is exported
+PVSCAN_RE = re.compile(r'PV\s+(\S+)\s+(?:is in exported\s+)?VG\s+(\S+)')
+
 
 class MountpointFileSystemMixin:
     def __init__(self, *args, **kwargs):
@@ -30,8 +40,8 @@ class MountpointFileSystemMixin:
         """
         parser = self.volume.disk.parser
 
-        if parser.mountdir and not os.path.exists(parser.mountdir):
-            os.makedirs(parser.mountdir)
+        if parser.mountdir:
+            os.makedirs(parser.mountdir, exist_ok=True)
 
         if parser.pretty:
             md = parser.mountdir or tempfile.gettempdir()
@@ -47,28 +57,26 @@ class MountpointFileSystemMixin:
                                                     self.volume.get_safe_label() or fstype or 'volume')
             if suffix:
                 pretty_label += "-" + suffix
-            path = os.path.join(md, pretty_label)
-
-            # check if path already exists, otherwise try to find another nice path
-            if os.path.exists(path):
-                for i in range(2, 100):
-                    path = os.path.join(md, pretty_label + "-" + str(i))
-                    if not os.path.exists(path):
-                        break
-                else:
-                    logger.error("Could not find free mountdir.")
-                    raise NoMountpointAvailableError()
 
-            # noinspection PyBroadException
-            try:
-                os.mkdir(path, 777)
+            # try to create the path, if it already exists try to find another nice path
+            for i in range(1, 100):
+                path = os.path.join(md, pretty_label if i == 1 else "{0}-{1}".format(pretty_label, i))
+                # noinspection PyBroadException
+                try:
+                    os.mkdir(path, 777)
+                except FileExistsError:
+                    continue
+                except Exception:
+                    logger.exception("Could not create mountdir.")
+                    raise NoMountpointAvailableError()
                 self.mountpoint = path
-            except Exception:
-                logger.exception("Could not create mountdir.")
+                break
+            else:
+                logger.error("Could not find free mountdir.")
                 raise NoMountpointAvailableError()
         else:
-            t = tempfile.mkdtemp(prefix='im_' + self.volume.index + '_',
-                                 suffix='_' + self.volume.get_safe_label() + ("_" + suffix if suffix else ""),
+            t = tempfile.mkdtemp(prefix='im_{0}_'.format(self.volume.index),
+                                 suffix='_{0}{1}'.format(self.volume.get_safe_label(), "_" + suffix if suffix else ""),
                                  dir=parser.mountdir)
             self.mountpoint = t
 
@@ -79,6 +87,23 @@ class MountpointFileSystemMixin:
             os.rmdir(self.mountpoint)
             self.mountpoint = None
 
+    @contextlib.contextmanager
+    def _mountpoint_context(self, casename=None, suffix=''):
+        """Context manager that creates a mountpoint using :func:`_make_mountpoint` and clears it again using
+        :func:`_clear_mountpoint` when an exception is raised within the context.
+
+        :returns: the mountpoint path
+        :raises NoMountpointAvailableError: if no mountpoint could be made
+        """
+
+        self._make_mountpoint(casename=casename, suffix=suffix)
+        try:
+            yield self.mountpoint
+        except Exception:
+            # undo the creation of the mountpoint
+            self._clear_mountpoint()
+            raise
+
     def unmount(self, allow_lazy=False):
         """Unmounts the given volume."""
         super().unmount(allow_lazy=allow_lazy)
@@ -101,27 +126,26 @@ class LoopbackFileSystemMixin:
         :raises NoLoopbackAvailableError: if no loopback could be found
         """
 
-        # noinspection PyBroadException
-        try:
-            self.loopback = _util.check_output_(['losetup', '-f']).strip()
-        except Exception:
-            logger.warning("No free loopback device found.", exc_info=True)
-            raise NoLoopbackAvailableError()
+        # let losetup find the free loopback device and attach it in one go, so no other process can claim the same
+        # loopback device in between
+        cmd = ['losetup', '--find', '--show']
+        if not self.volume.disk.read_write:
+            cmd += ['-r']
+        cmd += ['-o', str(self.volume.offset)]
+        if self.volume.size:
+            cmd += ['--sizelimit', str(self.volume.size)]
+        cmd += [self.volume.get_raw_path()]
 
         # noinspection PyBroadException
         try:
-            cmd = ['losetup']
-            if not self.volume.disk.read_write:
-                cmd += ['-r']
-            cmd += ['-o', str(self.volume.offset)]
-            if self.volume.size:
-                cmd += ['--sizelimit', str(self.volume.size)]
-            cmd += [self.loopback, self.volume.get_raw_path()]
-
-            _util.check_call_(cmd, stdout=subprocess.PIPE)
+            self.loopback = _util.check_output_(cmd).strip()
         except Exception:
             logger.exception("Loopback device could not be mounted.")
-            self._free_loopback()
+            raise NoLoopbackAvailableError()
+
+        if not self.loopback:
+            logger.warning("No free loopback device found.")
+            self.loopback = None
             raise NoLoopbackAvailableError()
 
     def _free_loopback(self):
@@ -173,18 +197,35 @@ class FileSystem:
         :return: Dict with mapping of FsType() objects to scores
         """
 
-        if source == "guid" and description in cls.guids:
+        # GUIDs are stored in upper case, but tools do not agree on the case they print them in
+        if source == "guid" and description.upper() in cls.guids:
             return {cls: 100}
 
         description = description.lower()
         if description == cls.type:
             return {cls: 100}
-        elif re.search(r"\b" + cls.type + r"\b", description):
+        type_re, aliases_re = cls._detect_patterns()
+        if type_re.search(description):
             return {cls: 80}
-        elif any((re.search(r"\b" + alias + r"\b", description) for alias in cls.aliases)):
+        elif aliases_re is not None and aliases_re.search(description):
             return {cls: 70}
         return {}
 
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _detect_patterns(cls):
+        """Compiles the patterns used by :meth:`detect` to find the type and aliases as separate words in a
+        description. Names are escaped, so types such as 'hfs+' and '4.2bsd' are matched literally, and a trailing
+        '+' counts as part of the word, so 'hfs' does not match 'hfs+'.
+
+        :return: tuple of the compiled type pattern and the compiled pattern for all aliases (or None)
+        """
+        def word(name):
+            return r"(?<!\w)" + re.escape(name) + r"(?![\w+])"
+
+        aliases_re = re.compile("|".join(word(alias) for alias in cls.aliases)) if cls.aliases else None
+        return re.compile(word(cls.type)), aliases_re
+
     def mount(self):
         """Mounts the filesystem. Must be implemented by subclasses.
 
@@ -207,32 +248,23 @@ class MountFileSystem(MountpointFileSystemMixin, FileSystem):
         :raises UnsupportedFilesystemError: when the volume system type can not be mounted.
         """
 
-        self._make_mountpoint()
-        try:
+        with self._mountpoint_context():
             self._call_mount(self.volume, self.mountpoint, self._mount_type or self.type, self._mount_opts)
-        except Exception:
-            # undo the creation of the mountpoint
-            self._clear_mountpoint()
-            raise
 
     def _call_mount(self, volume, mountpoint, type=None, opts=""):
         """Calls the mount command, specifying the mount type and mount options."""
 
         # default arguments for calling mount
-        if opts and not opts.endswith(','):
-            opts += ","
-        opts += 'loop,offset=' + str(volume.offset) + ',sizelimit=' + str(volume.size)
-
-        # building the command
-        cmd = ['mount', volume.get_raw_path(), mountpoint, '-o', opts]
+        options = [opts.rstrip(',')] if opts else []
+        options.append(LOOP_MOUNT_OPTS.format(offset=volume.offset, size=volume.size))
 
         # add read-only if needed
         if not volume.disk.read_write:
-            cmd[-1] += ',ro'
+            options.append('ro')
 
-        # add the type if specified
-        if type is not None:
-            cmd += ['-t', type]
+        # building the command, adding the type if specified
+        type_args = ('-t', type) if type is not None else ()
+        cmd = ('mount', volume.get_raw_path(), mountpoint, '-o', ','.join(options)) + type_args
 
         _util.check_output_(cmd, stderr=subprocess.STDOUT)
 
@@ -253,13 +285,8 @@ class UnknownFileSystem(MountFileSystem):
 
     def mount(self):
         # explicitly not specifying any type
-        self._make_mountpoint()
-        try:
+        with self._mountpoint_context():
             self._call_mount(self.volume, self.mountpoint)
-        except Exception:
-            # undo the creation of the mountpoint
-            self._clear_mountpoint()
-            raise
 
 
 class VolumeSystemFileSystem(FileSystem):
@@ -414,14 +441,13 @@ class VmfsFileSystem(LoopbackFileSystemMixin, MountFileSystem):
     guids = ['2AE031AA-0F40-DB11-9590-000C2911D1B8']
 
     def mount(self):
-        self._make_mountpoint()
-        self._find_loopback()
-        try:
-            _util.check_call_(['vmfs-fuse', self.loopback, self.mountpoint], stdout=subprocess.PIPE)
-        except Exception:
-            self._free_loopback()
-            self._clear_mountpoint()
-            raise
+        with self._mountpoint_context():
+            self._find_loopback()
+            try:
+                _util.check_call_(['vmfs-fuse', self.loopback, self.mountpoint], stdout=subprocess.DEVNULL)
+            except Exception:
+                self._free_loopback()
+                raise
 
 
 class Jffs2FileSystem(MountFileSystem):
@@ -442,8 +468,8 @@ class Jffs2FileSystem(MountFileSystem):
         _util.check_call_(['modprobe', '-v', 'mtdblock'])
         _util.check_call_(['dd', 'if=' + self.volume.get_raw_path(), 'of=/dev/mtd0'])
 
-        self._make_mountpoint()
-        _util.check_call_(['mount', '-t', 'jffs2', '/dev/mtdblock0', self.mountpoint])
+        with self._mountpoint_context():
+            _util.check_call_(['mount', '-t', 'jffs2', '/dev/mtdblock0', self.mountpoint])
 
 
 class LuksFileSystem(LoopbackFileSystemMixin, FileSystem):
@@ -508,7 +534,7 @@ class LuksFileSystem(LoopbackFileSystemMixin, FileSystem):
             raise ArgumentError()
 
         # Open the LUKS container
-        self.luks_name = 'image_mounter_luks_' + str(random.randint(10000, 99999))
+        self.luks_name = 'image_mounter_luks_{0}'.format(random.randint(10000, 99999))
 
         # noinspection PyBroadException
         try:
@@ -518,13 +544,12 @@ class LuksFileSystem(LoopbackFileSystemMixin, FileSystem):
                 cmd.insert(1, '-r')
 
             if key is not None:
-                logger.debug('$ {0}'.format(' '.join(cmd)))
-                # for py 3.2+, we could have used input=, but that doesn't exist in py2.7.
-                p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                p.communicate(key.encode("utf-8"))
-                p.wait()
-                retcode = p.poll()
-                if retcode:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('$ %s', ' '.join(cmd))
+                # only the key is passed through a pipe, the output of cryptsetup is not used
+                result = subprocess.run(cmd, input=key.encode("utf-8"),
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if result.returncode:
                     raise KeyInvalidError()
             else:
                 _util.check_call_(cmd)
@@ -555,7 +580,7 @@ class LuksFileSystem(LoopbackFileSystemMixin, FileSystem):
 
     def unmount(self, allow_lazy=False):
         if self.luks_name is not None:
-            _util.check_call_(['cryptsetup', 'luksClose', self.luks_name], wrap_error=True, stdout=subprocess.PIPE)
+            _util.check_call_(['cryptsetup', 'luksClose', self.luks_name], wrap_error=True, stdout=subprocess.DEVNULL)
             self.luks_name = None
         super().unmount(allow_lazy=allow_lazy)
 
@@ -586,8 +611,6 @@ class BdeFileSystem(MountpointFileSystemMixin, FileSystem):
         :raises SubsystemError: when the underlying command fails
         """
 
-        self._make_mountpoint()
-
         try:
             if self.volume.key:
                 t, v = self.volume.key.split(':', 1)
@@ -599,15 +622,15 @@ class BdeFileSystem(MountpointFileSystemMixin, FileSystem):
             logger.exception("Invalid key material provided (%s) for %s. Expecting [arg]:[value]", self.volume.key, self.volume)
             raise ArgumentError()
 
-        # noinspection PyBroadException
-        try:
-            cmd = ["bdemount", self.volume.get_raw_path(), self.mountpoint, '-o', str(self.volume.offset)]
-            cmd.extend(key)
-            _util.check_call_(cmd)
-        except Exception as e:
-            self._clear_mountpoint()
-            logger.exception("Failed mounting BDE volume %s.", self.volume)
-            raise SubsystemError(e)
+        with self._mountpoint_context():
+            # noinspection PyBroadException
+            try:
+                cmd = ["bdemount", self.volume.get_raw_path(), self.mountpoint, '-o', str(self.volume.offset)]
+                cmd.extend(key)
+                _util.check_call_(cmd)
+            except Exception as e:
+                logger.exception("Failed mounting BDE volume %s.", self.volume)
+                raise SubsystemError(e)
 
         container = self.volume.volumes._make_single_subvolume(flag='alloc', offset=0, size=self.volume.size)
         container.info['fsdescription'] = 'BDE Volume'
@@ -644,17 +667,15 @@ class LvmFileSystem(LoopbackFileSystemMixin, FileSystem):
         try:
             # Scan for new lvm volumes
             result = _util.check_output_(["lvm", "pvscan"])
-            for line in result.splitlines():
-                if (self.loopback is not None and self.loopback in line) or self.volume.get_raw_path() in line:
-                    for vg in re.findall(r'VG (\S+)', line):
-                        self.vgname = vg
+            vg_by_pv = dict(PVSCAN_RE.findall(result))
+            self.vgname = vg_by_pv.get(self.loopback) or vg_by_pv.get(self.volume.get_raw_path())
 
             if not self.vgname:
                 logger.warning("Volume is not a volume group. (Searching for %s)", self.loopback)
                 raise IncorrectFilesystemError()
 
             # Enable lvm volumes
-            _util.check_call_(["lvm", "vgchange", "-a", "y", self.vgname], stdout=subprocess.PIPE)
+            _util.check_call_(["lvm", "vgchange", "-a", "y", self.vgname], stdout=subprocess.DEVNULL)
         except Exception:
             self._free_loopback()
             self.vgname = None
@@ -668,7 +689,7 @@ class LvmFileSystem(LoopbackFileSystemMixin, FileSystem):
 
     def unmount(self, allow_lazy=False):
         if self.vgname:
-            _util.check_call_(["lvm", 'vgchange', '-a', 'n', self.vgname], wrap_error=True, stdout=subprocess.PIPE)
+            _util.check_call_(["lvm", 'vgchange', '-a', 'n', self.vgname], wrap_error=True, stdout=subprocess.DEVNULL)
             self.vgname = None
 
         super().unmount(allow_lazy=allow_lazy)
@@ -709,7 +730,7 @@ class VhdFileSystemType(FileSystem):
             cmd = ['qemu-nbd', '-c', self.nbd, self.volume.get_raw_path()]
             if not self.volume.disk.read_write:
                 cmd.insert(1, '--read-only')
-            _util.check_call_(cmd, stdout=subprocess.PIPE)
+            _util.check_call_(cmd, stdout=subprocess.DEVNULL)
         except Exception:
             logger.exception("Network Block Device could not be mounted.")
             raise NoNetworkBlockAvailableError()
@@ -721,7 +742,7 @@ class VhdFileSystemType(FileSystem):
 
     def unmount(self, allow_lazy=False):
         if self.nbd:
-            _util.check_call_(['qemu-nbd', '-d', self.nbd], wrap_error=True, stdout=subprocess.PIPE)
+            _util.check_call_(['qemu-nbd', '-d', self.nbd], wrap_error=True, stdout=subprocess.DEVNULL)
             self.nbd = None
 
         super().unmount(allow_lazy=allow_lazy)
@@ -838,32 +859,30 @@ class CarveFileSystem(MountpointFileSystemMixin, LoopbackFileSystemMixin, FileSy
         :raises NoMountpointAvailableError: if there is no mountpoint available
         :raises NoLoopbackAvailableError: if there is no loopback available (only when volume has no slot number)
         """
-        self._make_mountpoint(suffix='carve')
-
-        if not self.volume.slot:
-            loopback = self.volume.loopback
-            if loopback is None:
-                self._find_loopback()
-                loopback = self.loopback
-
-            try:
-                _util.check_call_(["photorec", "/d", self.mountpoint + os.sep, "/cmd", loopback,
-                                   ("freespace," if self.freespace else "") + "search"])
-
-            except Exception as e:
-                logger.exception("Failed carving the volume.")
-                self._clear_mountpoint()
-                raise SubsystemError(e)
-        else:
-            # noinspection PyBroadException
-            try:
-                _util.check_call_(["photorec", "/d", self.mountpoint + os.sep, "/cmd", self.volume.get_raw_path(),
-                                   str(self.volume.slot) + (",freespace" if self.freespace else "") + ",search"])
+        with self._mountpoint_context(suffix='carve'):
+            if not self.volume.slot:
+                loopback = self.volume.loopback
+                if loopback is None:
+                    self._find_loopback()
+                    loopback = self.loopback
+
+                try:
+                    _util.check_call_(["photorec", "/d", self.mountpoint + os.sep, "/cmd", loopback,
+                                       ("freespace," if self.freespace else "") + "search"])
+
+                except Exception as e:
+                    logger.exception("Failed carving the volume.")
+                    raise SubsystemError(e)
+            else:
+                # noinspection PyBroadException
+                try:
+                    options = "{0}{1},search".format(self.volume.slot, ",freespace" if self.freespace else "")
+                    _util.check_call_(["photorec", "/d", self.mountpoint + os.sep, "/cmd", self.volume.get_raw_path(),
+                                       options])
 
-            except Exception as e:
-                logger.exception("Failed carving the volume.")
-                self._clear_mountpoint()
-                raise SubsystemError(e)
+                except Exception as e:
+                    logger.exception("Failed carving the volume.")
+                    raise SubsystemError(e)
 
     def unmount(self, allow_lazy=False):
         """Unmounts the given volume."""
@@ -888,17 +907,15 @@ class VolumeShadowCopyFileSystem(MountpointFileSystemMixin, FileSystem):
         :raises NoMountpointAvailableError: if there is no mountpoint available
         """
 
-        self._make_mountpoint(suffix="vss")
+        with self._mountpoint_context(suffix="vss"):
+            try:
+                _util.check_call_(["vshadowmount", "-o", str(self.volume.offset), self.volume.get_raw_path(),
+                                   self.mountpoint])
+            except Exception as e:
+                logger.exception("Failed mounting the volume shadow copies.")
+                raise SubsystemError(e)
 
-        try:
-            _util.check_call_(["vshadowmount", "-o", str(self.volume.offset), self.volume.get_raw_path(),
-                               self.mountpoint])
-        except Exception as e:
-            logger.exception("Failed mounting the volume shadow copies.")
-            self._clear_mountpoint()
-            raise SubsystemError(e)
-        else:
-            return list(self.volume.volumes.detect_volumes(vstype='vss', method='vss'))
+        return list(self.volume.volumes.detect_volumes(vstype='vss', method='vss'))
 
     def unmount(self, allow_lazy=False):
         if self.mountpoint:
@@ -918,3 +935,30 @@ FILE_SYSTEM_TYPES = {}
 for _, cls in inspect.getmembers(sys.modules[__name__], inspect.isclass):
     if issubclass(cls, FileSystem) and cls != FileSystem and cls.type is not None:
         FILE_SYSTEM_TYPES[cls.type] = cls
+
+
+def detect_all(source, description):
+    """Combines the results of :func:`FileSystem.detect` of all :data:`FILE_SYSTEM_TYPES` for the provided source and
+    description. As many volumes share the same short descriptions, the result is cached per (source, description)
+    pair, except for the magic output, which usually contains serial numbers or labels that are unique to the volume.
+
+    :param source: The source of the description
+    :param description: The description to detect with
+    :return: read-only mapping of FsType() objects to their combined scores
+    """
+
+    if source == 'magic':
+        return types.MappingProxyType(_detect_all(source, description))
+    return _detect_all_cached(source, description)
+
+
+@functools.lru_cache(maxsize=256)
+def _detect_all_cached(source, description):
+    return types.MappingProxyType(_detect_all(source, description))
+
+
+def _detect_all(source, description):
+    result = collections.Counter()
+    for type in FILE_SYSTEM_TYPES.values():
+        result.update(type.detect(source, description))
+    return result
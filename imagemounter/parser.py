@@ -69,6 +69,13 @@ class ImageParser:
                 return d
         raise KeyError(item)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Cleans up using :func:`force_clean` when the parser is used as context manager."""
+        self.force_clean()
+
     def add_disk(self, path, force_disk_indexes=True, **args):
         """Adds a disk specified by the path to the ImageParser.
 
@@ -209,16 +216,16 @@ class ImageParser:
         :raises: NoRootFoundError if no root could be found
         :return: the root :class:`Volume`
         """
-        volumes = list(sorted((v for v in self.get_volumes() if v.mountpoint and v.info.get('lastmountpoint')),
-                              key=lambda v: v.numeric_index))
+        # sorting on the last mount point ensures that parents are bind mounted before their children and that the
+        # root comes first, the index is used to get a stable choice when there are multiple roots
+        volumes = sorted((v for v in self.get_volumes() if v.mountpoint and v.info.get('lastmountpoint')),
+                         key=lambda v: (v.info['lastmountpoint'], v.numeric_index))
 
-        try:
-            root = list(filter(lambda x: x.info.get('lastmountpoint') == '/', volumes))[0]
-        except IndexError:
+        if not volumes or volumes[0].info['lastmountpoint'] != '/':
             logger.error("Could not find / while reconstructing, aborting!")
             raise NoRootFoundError()
 
-        volumes.remove(root)
+        root = volumes.pop(0)
 
         for v in volumes:
             if v.info.get('lastmountpoint') == root.info.get('lastmountpoint'):
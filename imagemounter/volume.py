@@ -1,4 +1,5 @@
 import collections
+import concurrent.futures
 import io
 import logging
 import os
@@ -14,6 +15,32 @@ from imagemounter.volume_system import VolumeSystem
 
 logger = logging.getLogger(__name__)
 
+# Maps our file system types to the -f argument of fsstat. Setting the fstype explicitly makes fsstat much faster and
+# more reliable. In some versions, the auto-detect yaffs2 check takes ages for large images
+FSSTAT_FSTYPES = {
+    "ntfs": "ntfs", "fat": "fat", "ext": "ext", "iso": "iso9660", "hfs+": "hfs",
+    "ufs": "ufs", "swap": "swap", "exfat": "exfat",
+}
+
+# Maps the fields in the fsstat output to the keys in Volume.info
+FSSTAT_FIELDS = {
+    "File System Type": 'statfstype',
+    "Last Mount Point": 'lastmountpoint',
+    "Last mounted on": 'lastmountpoint',
+    "Volume Name": 'label',
+    "Version": 'version',
+    "Source OS": 'version',
+}
+# Matches either one of the fields above, or the start of the cylinder/block group information, after which fsstat
+# does not output anything of interest anymore
+FSSTAT_LINE_RE = re.compile(r'^(?:({0}):(.*)$|.*(?:CYLINDER|BLOCK) GROUP INFORMATION)'.format(
+    "|".join(map(re.escape, FSSTAT_FIELDS))))
+
+# fsstat is run in a shared worker pool, so no new thread has to be spawned for every volume that is mounted
+_stats_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='imagemounter-fsstat')
+# volume data is prefetched in a separate pool, as prefetching itself waits for the fsstat pool
+_prefetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='imagemounter-prefetch')
+
 
 class Volume:
     """Information about a volume. Note that every detected volume gets their own Volume object, though it may or may
@@ -69,6 +96,8 @@ class Volume:
         self.info = {}
         self.bindmounts = []
         self._real_path = None
+        self._prefetched = None
+        self._prefetched_for = None
 
         self.was_mounted = False
         self.is_mounted = False
@@ -321,7 +350,11 @@ class Volume:
             self.exception = None
 
         try:
-            if not self._should_mount(only_mount, skip_mount):
+            if self._prefetched is not None and self._prefetched_for == (only_mount, skip_mount):
+                # prefetching was only started because this volume should be mounted. Its fsstat call may already be
+                # changing the label and last mountpoint this was decided on, so the decision is not made again.
+                pass
+            elif not self._should_mount(only_mount, skip_mount):
                 yield self
                 return
 
@@ -341,6 +374,38 @@ class Volume:
             for v in self.volumes:
                 yield from v.init(only_mount, skip_mount, swallow_exceptions)
 
+    def prefetch(self, only_mount=None, skip_mount=None):
+        """Starts determining the file system type and loading the fsstat data of this volume in the background, so
+        that :func:`mount` does not have to wait for all of these commands when it is called. This allows this
+        data to be obtained for all volumes of a volume system at the same time, rather than one after another.
+
+        Does nothing if the volume would not be mounted by :func:`init`.
+
+        :param only_mount: if specified, only volume indexes in this list are prefetched.
+        :param skip_mount: if specified, volume indexes in this list are not prefetched.
+        """
+
+        if self._prefetched is None and self.parent.is_mounted and not self.is_mounted and self.flag == 'alloc' and \
+                self.info.get('raid_status') != 'waiting' and self._should_mount(only_mount, skip_mount):
+            self._prefetched = _prefetch_pool.submit(self._load_volume_data)
+            self._prefetched_for = (only_mount, skip_mount)
+
+    def _cancel_prefetch(self):
+        """Cancels prefetching the data of this volume, or waits for it to finish if it has already started, so that
+        nothing reads from the volume anymore when the disk is unmounted.
+        """
+
+        if self._prefetched is not None:
+            prefetched, self._prefetched, self._prefetched_for = self._prefetched, None, None
+            if not prefetched.cancel():
+                concurrent.futures.wait([prefetched])
+
+    def _load_volume_data(self):
+        """Determines the file system type and loads the fsstat data of this volume."""
+
+        self.filesystem = self.determine_fs_type()
+        self._load_fsstat_data()
+
     def init_volume(self):
         """Initializes a single volume. You should use this method instead of :func:`mount` if you want some sane checks
         before mounting.
@@ -395,9 +460,8 @@ class Volume:
             if not description:
                 continue
 
-            # Iterate over all results and update the certainty of all FS types
-            for type in FILE_SYSTEM_TYPES.values():
-                result.update(type.detect(source, description))
+            # Update the certainty of all FS types
+            result.update(filesystems.detect_all(source, description))
 
             # Now sort the results by their certainty
             logger.debug("Current certainty levels: {}".format(result))
@@ -445,8 +509,11 @@ class Volume:
         if not self.parent.is_mounted:
             raise NotMountedError(self.parent)
 
-        self.filesystem = self.determine_fs_type()
-        self._load_fsstat_data()
+        if self._prefetched is not None:
+            prefetched, self._prefetched = self._prefetched, None
+            prefetched.result()
+        else:
+            self._load_volume_data()
 
         # Prepare mount command
         try:
@@ -472,7 +539,7 @@ class Volume:
         if not self.mountpoint:
             raise NotMountedError(self)
         try:
-            _util.check_call_(['mount', '--bind', self.mountpoint, mountpoint], stdout=subprocess.PIPE)
+            _util.check_call_(['mount', '--bind', self.mountpoint, mountpoint], stdout=subprocess.DEVNULL)
             self.bindmounts.append(mountpoint)
             return True
         except Exception as e:
@@ -495,43 +562,52 @@ class Volume:
     def _load_fsstat_data(self, timeout=3):
         """Using :command:`fsstat`, adds some additional information of the volume to the Volume."""
 
+        # set once fsstat has been started (or failed to start), as the timeout must not include the time spent
+        # waiting for a free worker in the pool
+        started = threading.Event()
+
         def stats_thread():
             try:
                 cmd = ['fsstat', self.get_raw_path(), '-o', str(self.offset // self.disk.block_size)]
 
-                # Setting the fstype explicitly makes fsstat much faster and more reliable
-                # In some versions, the auto-detect yaffs2 check takes ages for large images
-                fstype = {
-                    "ntfs": "ntfs", "fat": "fat", "ext": "ext", "iso": "iso9660", "hfs+": "hfs",
-                    "ufs": "ufs", "swap": "swap", "exfat": "exfat",
-                }.get(self.filesystem.type, None)
+                fstype = FSSTAT_FSTYPES.get(self.filesystem.type, None)
                 if fstype:
                     cmd.extend(["-f", fstype])
 
-                logger.debug('$ {0}'.format(' '.join(cmd)))
-                stats_thread.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-                for line in iter(stats_thread.process.stdout.readline, b''):
-                    line = line.decode('utf-8')
-                    logger.debug('< {0}'.format(line))
-                    if line.startswith("File System Type:"):
-                        self.info['statfstype'] = line[line.index(':') + 2:].strip()
-                    elif line.startswith("Last Mount Point:") or line.startswith("Last mounted on:"):
-                        self.info['lastmountpoint'] = line[line.index(':') + 2:].strip().replace("//", "/")
-                    elif line.startswith("Volume Name:") and not self.info.get('label'):
-                        self.info['label'] = line[line.index(':') + 2:].strip()
-                    elif line.startswith("Version:"):
-                        self.info['version'] = line[line.index(':') + 2:].strip()
-                    elif line.startswith("Source OS:"):
-                        self.info['version'] = line[line.index(':') + 2:].strip()
-                    elif 'CYLINDER GROUP INFORMATION' in line or 'BLOCK GROUP INFORMATION' in line:
-                        # noinspection PyBroadException
-                        try:
-                            stats_thread.process.terminate()
-                            logger.debug("Terminated fsstat at cylinder/block group information.")
-                        except Exception:
-                            pass
-                        break
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug('$ %s', ' '.join(cmd))
+                # stderr is not read, so it must not be a pipe that fsstat could block on
+                stats_thread.process = process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                                                  stderr=subprocess.DEVNULL)
+                started.set()
+                stdout = process.stdout
+                try:
+                    for line in stdout:
+                        # labels are not necessarily UTF-8, which must not cost us the remaining fields
+                        line = line.decode('utf-8', errors='replace')
+                        logger.debug('< %s', line)
+                        field = FSSTAT_LINE_RE.match(line)
+                        if not field:
+                            continue
+                        elif field.group(1):
+                            key, value = FSSTAT_FIELDS[field.group(1)], field.group(2).strip()
+                            if key == 'lastmountpoint':
+                                value = value.replace("//", "/")
+                            elif key == 'label' and self.info.get('label'):
+                                continue
+                            self.info[key] = value
+                        else:
+                            # noinspection PyBroadException
+                            try:
+                                process.terminate()
+                                logger.debug("Terminated fsstat at cylinder/block group information.")
+                            except Exception:
+                                pass
+                            break
+                finally:
+                    # make sure the process is reaped, also when it was terminated early
+                    stdout.close()
+                    process.wait()
 
                 if self.info.get('lastmountpoint') and self.info.get('label'):
                     self.info['label'] = "{0} ({1})".format(self.info['lastmountpoint'], self.info['label'])
@@ -546,19 +622,22 @@ class Volume:
 
             except Exception:  # ignore any exceptions here.
                 logger.exception("Error while obtaining stats.")
+            finally:
+                started.set()
 
         stats_thread.process = None
 
-        thread = threading.Thread(target=stats_thread)
-        thread.start()
-        thread.join(timeout)
-        if thread.is_alive():
+        future = _stats_pool.submit(stats_thread)
+        started.wait()
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
             # noinspection PyBroadException
             try:
                 stats_thread.process.terminate()
             except Exception:
                 pass
-            thread.join()
+            future.result()
             logger.debug("Killed fsstat after {0}s".format(timeout))
 
     def detect_mountpoint(self):
@@ -605,6 +684,8 @@ class Volume:
         :raises CleanupError: if the cleanup fails
         """
 
+        self._cancel_prefetch()
+
         for volume in self.volumes:
             try:
                 volume.unmount(allow_lazy=allow_lazy)
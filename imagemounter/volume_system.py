@@ -12,6 +12,10 @@ from imagemounter.exceptions import ArgumentError, SubsystemError, ModuleNotFoun
 
 logger = logging.getLogger(__name__)
 
+# Matches the start of a logical volume and the LV properties we are interested in from the output of lvdisplay
+LVDISPLAY_RE = re.compile(r'^\s*(?:--- Logical volume ---|LV (Name|Size|Path)\s+(.*?))\s*$', re.MULTILINE)
+LVM_SIZE_UNITS = {'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
 
 class VolumeSystem:
     """A VolumeSystem is a collection of volumes. Every :class:`Disk` contains exactly one VolumeSystem. Each
@@ -283,30 +287,33 @@ class Pytsk3VolumeDetector(VolumeDetector):
     def detect(self, volume_system, vstype='detect'):
         """Generator that mounts every partition of this image and yields the mountpoint."""
 
+        import pytsk3
+
         # Loop over all volumes in image.
         for p in self._find_volumes(volume_system, vstype):
-            import pytsk3
+            # read the attributes only once, as every access goes through the C extension
+            start, length, flags = p.start, p.len, p.flags
 
             volume = volume_system._make_subvolume(
                 index=self._format_index(volume_system, p.addr),
-                offset=p.start * volume_system.disk.block_size,
-                size=p.len * volume_system.disk.block_size
+                offset=start * volume_system.disk.block_size,
+                size=length * volume_system.disk.block_size
             )
             # Fill volume with more information
-            volume.info['fsdescription'] = p.desc.strip().decode('utf-8')
+            volume.info['fsdescription'] = p.desc.strip().decode('utf-8', errors='replace')
 
-            if p.flags == pytsk3.TSK_VS_PART_FLAG_ALLOC:
+            if flags == pytsk3.TSK_VS_PART_FLAG_ALLOC:
                 volume.flag = 'alloc'
                 volume.slot = _util.determine_slot(p.table_num, p.slot_num)
                 volume_system._assign_disktype_data(volume)
-                logger.info("Found allocated {2}: block offset: {0}, length: {1} ".format(p.start, p.len,
+                logger.info("Found allocated {2}: block offset: {0}, length: {1} ".format(start, length,
                                                                                           volume.info['fsdescription']))
-            elif p.flags == pytsk3.TSK_VS_PART_FLAG_UNALLOC:
+            elif flags == pytsk3.TSK_VS_PART_FLAG_UNALLOC:
                 volume.flag = 'unalloc'
-                logger.info("Found unallocated space: block offset: {0}, length: {1} ".format(p.start, p.len))
-            elif p.flags == pytsk3.TSK_VS_PART_FLAG_META:
+                logger.info("Found unallocated space: block offset: {0}, length: {1} ".format(start, length))
+            elif flags == pytsk3.TSK_VS_PART_FLAG_META:
                 volume.flag = 'meta'
-                logger.info("Found meta volume: block offset: {0}, length: {1} ".format(p.start, p.len))
+                logger.info("Found meta volume: block offset: {0}, length: {1} ".format(start, length))
 
             yield volume
 
@@ -455,10 +462,11 @@ class MmlsVolumeDetector(VolumeDetector):
                 logger.exception("Error while parsing mmls output")
                 continue
 
-            if slot.lower() == 'meta':
+            slot_lower = slot.lower()
+            if slot_lower == 'meta':
                 volume.flag = 'meta'
                 logger.info("Found meta volume: block offset: {0}, length: {1}".format(start, length))
-            elif slot.lower().startswith('-----'):
+            elif slot_lower.startswith('-----'):
                 volume.flag = 'unalloc'
                 logger.info("Found unallocated space: block offset: {0}, length: {1}".format(start, length))
             else:
@@ -522,22 +530,22 @@ class LvmVolumeDetector(VolumeDetector):
 
         result = _util.check_output_(["lvm", "lvdisplay", volume_group])
         cur_v = None
-        for line in result.splitlines():
-            if "--- Logical volume ---" in line:
+        for match in LVDISPLAY_RE.finditer(result):
+            key, value = match.groups()
+            if key is None:
                 cur_v = volume_system._make_subvolume(
                     index=self._format_index(volume_system, len(volume_system)),
-                    flag='alloc'
+                    flag='alloc',
+                    offset=0
                 )
                 cur_v.info['fsdescription'] = 'Logical Volume'
-            if "LV Name" in line:
-                cur_v.info['label'] = line.replace("LV Name", "").strip()
-            if "LV Size" in line:
-                size, unit = line.replace("LV Size", "").strip().split(" ", 1)
-                cur_v.size = int(float(re.sub(r'[^0-9.]', "", size.replace(',', '.'))) * {'KiB': 1024, 'MiB': 1024 ** 2,
-                                                                  'GiB': 1024 ** 3, 'TiB': 1024 ** 4}.get(unit, 1))
-            if "LV Path" in line:
-                cur_v._real_path = line.replace("LV Path", "").strip()
-                cur_v.offset = 0
+            elif key == 'Name':
+                cur_v.info['label'] = value
+            elif key == 'Size':
+                size, unit = value.split(" ", 1)
+                cur_v.size = int(float(re.sub(r'[^0-9.]', "", size.replace(',', '.'))) * LVM_SIZE_UNITS.get(unit, 1))
+            elif key == 'Path':
+                cur_v._real_path = value
 
         logger.info("{0} volumes found".format(len(volume_system)))
         volume_system.volume_source = 'multi'
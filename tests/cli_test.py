@@ -56,3 +56,10 @@ class TestAppendDictAction:
         parser.add_argument('--test', action=AppendDictAction, default={"aa": "bb"})
 
         assert parser.parse_args(["--test", "x"]).test == {"*": 'x', 'aa': 'bb'}
+
+    def test_default_not_modified(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--test', action=AppendDictAction, default={"aa": "bb"})
+
+        assert parser.parse_args(["--test", "x"]).test == {"*": 'x', 'aa': 'bb'}
+        assert parser.parse_args([]).test == {'aa': 'bb'}
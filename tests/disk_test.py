@@ -0,0 +1,120 @@
+import concurrent.futures
+import threading
+
+from imagemounter.disk import Disk
+from imagemounter.parser import ImageParser
+
+
+class TestMountMethods:
+    def test_single_raw_image_used_directly(self, mocker):
+        mocker.patch("imagemounter.disk._util.command_exists", return_value=True)
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        assert disk._get_mount_methods('dd') == ['dummy', 'affuse', 'xmount']
+
+    def test_aff_image_not_used_directly(self, mocker):
+        mocker.patch("imagemounter.disk._util.command_exists", return_value=True)
+        disk = Disk(ImageParser(), path="/tmp/image.aff")
+        assert disk._get_mount_methods('dd') == ['affuse', 'xmount']
+
+    def test_read_write_not_used_directly(self, mocker):
+        mocker.patch("imagemounter.disk._util.command_exists", return_value=True)
+        disk = Disk(ImageParser(), path="/tmp/image.dd", read_write=True)
+        assert disk._get_mount_methods('dd') == ['xmount']
+
+    def test_only_installed_methods(self, mocker):
+        disk = Disk(ImageParser(), path="/tmp/image.zip")
+        mocker.patch("imagemounter.disk._util.command_exists", side_effect=lambda cmd: cmd in ('avfsd', 'xmount'))
+        assert disk._get_mount_methods('compressed') == ['avfs', 'xmount']
+        assert disk._get_mount_methods('vmdk') == ['xmount']
+
+    def test_explicit_method(self, mocker):
+        disk = Disk(ImageParser(), path="/tmp/image.E01", disk_mounter='xmount')
+        assert disk._get_mount_methods('encase') == ['xmount']
+
+
+class TestRwActive:
+    def test_no_rwpath(self):
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        assert not disk.rw_active()
+
+    def test_rwpath_written(self, tmp_path):
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        disk.rwpath = str(tmp_path / "cache")
+        with open(disk.rwpath, 'wb') as f:
+            f.write(b'data')
+        assert disk.rw_active()
+
+    def test_rwpath_empty_or_removed(self, tmp_path):
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        disk.rwpath = str(tmp_path / "cache")
+        assert not disk.rw_active()
+        open(disk.rwpath, 'wb').close()
+        assert not disk.rw_active()
+
+    def test_unused_cache_removed_on_unmount(self, tmp_path):
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        disk.rwpath = str(tmp_path / "cache")
+        open(disk.rwpath, 'wb').close()
+        disk.unmount()
+        assert not (tmp_path / "cache").exists()
+        assert disk.rwpath == ""
+
+    def test_used_cache_kept_on_unmount(self, tmp_path):
+        disk = Disk(ImageParser(), path="/tmp/image.dd")
+        disk.rwpath = str(tmp_path / "cache")
+        with open(disk.rwpath, 'wb') as f:
+            f.write(b'data')
+        disk.unmount()
+        assert (tmp_path / "cache").exists()
+        disk.unmount(remove_rw=True)
+        assert not (tmp_path / "cache").exists()
+
+
+class TestNbd:
+    def test_concurrent_mounts_use_different_devices(self, mocker, tmp_path):
+        attached = set()
+        searching = threading.Event()
+
+        def get_free_nbd_device():
+            searching.set()
+            return next(dev for dev in ('/dev/nbd0', '/dev/nbd1') if dev not in attached)
+
+        def check_call(cmd, *args, **kwargs):
+            # give the other disk the chance to look for a free device before this one is attached
+            searching.clear()
+            searching.wait(0.05)
+            attached.add(cmd[-2])
+
+        mocker.patch("imagemounter.disk._util.get_free_nbd_device", side_effect=get_free_nbd_device)
+        mocker.patch("imagemounter.disk._util.check_call_", side_effect=check_call)
+        mocker.patch("imagemounter.disk._util.check_output_")
+        mocker.patch("imagemounter.disk.time.sleep")
+        mocker.patch("imagemounter.disk.tempfile.mkdtemp", return_value=str(tmp_path))
+        mocker.patch.object(Disk, "_get_mount_methods", return_value=['qemu-nbd'])
+
+        disks = [Disk(ImageParser(), path="/tmp/image{}.qcow2".format(i)) for i in range(2)]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(Disk.mount, disks))
+
+        assert {disk.get_raw_path() for disk in disks} == {'/dev/nbd0', '/dev/nbd1'}
+
+
+class TestRawPath:
+    def test_preferred_file(self, tmp_path):
+        for name in ('ewf1', 'image.raw', '.hidden.dd', 'notes.txt'):
+            (tmp_path / name).touch()
+        disk = Disk(ImageParser(), path="/tmp/image.E01")
+        disk.mountpoint = str(tmp_path)
+        assert disk.get_raw_path() == str(tmp_path / 'image.raw')
+
+    def test_no_file(self, tmp_path):
+        disk = Disk(ImageParser(), path="/tmp/image.E01")
+        disk.mountpoint = str(tmp_path)
+        assert disk.get_raw_path() is None
+
+    def test_nbd(self, tmp_path):
+        (tmp_path / 'image.dd').touch()
+        disk = Disk(ImageParser(), path="/tmp/image.qcow2")
+        disk.mountpoint = str(tmp_path)
+        disk._paths['nbd'] = '/dev/nbd0'
+        assert disk.get_raw_path() == '/dev/nbd0'
@@ -1,3 +1,4 @@
+import functools
 import os
 
 import pytest
@@ -5,34 +6,54 @@ import pytest
 from imagemounter import ImageParser, dependencies
 
 
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+LFS_POINTER_PREFIX = b'version https://git-lfs'
+
+
+@functools.lru_cache(maxsize=None)
 def supportfs(fs):
     return dependencies.FileSystemTypeDependency(fs).is_available
 
 
+def image_available(path):
+    # the images are stored in Git LFS, without it only a small pointer file is checked out
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(LFS_POINTER_PREFIX)) != LFS_POINTER_PREFIX
+    except OSError:
+        return False
+
+
 def fullpath(fn):
-    return os.path.join(os.path.dirname(os.path.realpath(__file__)), fn)
+    path = os.path.join(TEST_DIR, fn)
+    if not image_available(path):
+        pytest.skip("{} is not available, fetch it with git lfs".format(fn))
+    return path
+
+
+def fsparam(type, filename, fs, *marks):
+    return pytest.param(type, filename,
+                        marks=[pytest.mark.skipif(not supportfs(fs), reason="{} not supported".format(fs)), *marks])
 
 
 @pytest.mark.parametrize("type,filename", [
-    pytest.param('cramfs', 'images/test.cramfs', marks=pytest.mark.skipif(not supportfs("cramfs"), reason="cramfs not supported")),
-    pytest.param('ext', 'images/test.ext3', marks=pytest.mark.skipif(not supportfs("ext3"), reason="ext3 not supported")),
-    pytest.param('fat', 'images/test.fat12', marks=pytest.mark.skipif(not supportfs("vfat"), reason="vfat not supported")),
-    pytest.param('iso', 'images/test.iso', marks=pytest.mark.skipif(not supportfs("iso9660"), reason="iso not supported")),
-    pytest.param('minix', 'images/test.minix', marks=pytest.mark.skipif(not supportfs("minix"), reason="minix not supported")),
-    pytest.param('ntfs', 'images/test.ntfs', marks=pytest.mark.skipif(not supportfs("ntfs"), reason="ntfs not supported")),
-    pytest.param('squashfs', 'images/test.sqsh', marks=[pytest.mark.xfail(reason="squashfs support is currently broken"),
-                                                        pytest.mark.skipif(not supportfs("squashfs"), reason="squashfs not supported")]),
-    pytest.param('iso', 'images/test.zip', marks=pytest.mark.skipif(not supportfs("iso9660"), reason="iso not supported")),
+    fsparam('cramfs', 'images/test.cramfs', 'cramfs'),
+    fsparam('ext', 'images/test.ext3', 'ext3'),
+    fsparam('fat', 'images/test.fat12', 'vfat'),
+    fsparam('iso', 'images/test.iso', 'iso9660'),
+    fsparam('minix', 'images/test.minix', 'minix'),
+    fsparam('ntfs', 'images/test.ntfs', 'ntfs'),
+    fsparam('squashfs', 'images/test.sqsh', 'squashfs',
+            pytest.mark.xfail(reason="squashfs support is currently broken")),
+    fsparam('iso', 'images/test.zip', 'iso9660'),
 ])
 def test_direct_mount(type, filename):
     volumes = []
-    parser = ImageParser([fullpath(filename)])
-    for v in parser.init():
-        if v.flag == "alloc":
-            assert v.mountpoint is not None
-        volumes.append(v)
-
-    parser.force_clean()
+    with ImageParser([fullpath(filename)]) as parser:
+        for v in parser.init():
+            if v.flag == "alloc":
+                assert v.mountpoint is not None
+            volumes.append(v)
 
     assert len(volumes) == 1
     assert volumes[0].filesystem.type == type
@@ -43,44 +64,35 @@ def test_direct_mount(type, filename):
 # identifier should be B8992A09-3AE9-47E3-8FD0-4A5B8389B0A4
 @pytest.mark.parametrize("key", ["p:test1234", "r:391798-523787-614746-034969-107921-412302-401654-479457"])
 def test_bde_mount(key):
-    parser = ImageParser([fullpath('images/bdetest.E01')], keys={"0": key})
-    for i, v in enumerate(parser.init()):
-        assert v.mountpoint is not None
-        assert v.flag == "alloc"
-        assert v.filesystem.type == "ntfs"
-        assert v.index == "0.0"
-        assert i == 0  # ensures we only have a single item in this iteration
-
-    parser.force_clean()
+    with ImageParser([fullpath('images/bdetest.E01')], keys={"0": key}) as parser:
+        for i, v in enumerate(parser.init()):
+            assert v.mountpoint is not None
+            assert v.flag == "alloc"
+            assert v.filesystem.type == "ntfs"
+            assert v.index == "0.0"
+            assert i == 0  # ensures we only have a single item in this iteration
 
 
 @pytest.mark.skipif(not dependencies.lvm.is_available, reason="lvm not available")
 def test_lvm_mount():
-    parser = ImageParser([fullpath('images/lvm.raw')])
-
-    volumes = []
-    for v in parser.init():
-        volumes.append(v)
+    with ImageParser([fullpath('images/lvm.raw')]) as parser:
+        volumes = list(parser.init())
 
-    assert len(volumes) == 2
-    assert volumes[0].mountpoint is not None
-    assert volumes[0].flag == "alloc"
-    assert volumes[0].filesystem.type == "ext"
-    assert volumes[0].index == "0.0"
-
-    parser.force_clean()
+        assert len(volumes) == 2
+        assert volumes[0].mountpoint is not None
+        assert volumes[0].flag == "alloc"
+        assert volumes[0].filesystem.type == "ext"
+        assert volumes[0].index == "0.0"
 
 
 def test_filesystem_mount():
     filename = 'images/test.mbr'
     volumes = []
-    parser = ImageParser([fullpath(filename)])
-    for v in parser.init():
-        if v.flag == "alloc" and v.index != "4":
-            assert v.mountpoint is not None
-        volumes.append(v)
-
-    parser.force_clean()
+    with ImageParser([fullpath(filename)]) as parser:
+        for v in parser.init():
+            if v.flag == "alloc" and v.index != "4":
+                assert v.mountpoint is not None
+            volumes.append(v)
 
     assert len(volumes) == 13
 
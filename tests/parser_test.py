@@ -5,6 +5,19 @@ from imagemounter.parser import ImageParser
 from imagemounter.volume import Volume
 
 
+def add_volumes(disk, *lastmountpoints):
+    """Adds a mounted volume to the disk for every last mount point provided."""
+    volumes = []
+    for index, lastmountpoint in enumerate(lastmountpoints, 1):
+        volume = Volume(disk)
+        volume.index = str(index)
+        volume.filesystem.mountpoint = 'xxx'
+        volume.info['lastmountpoint'] = lastmountpoint
+        volumes.append(volume)
+    disk.volumes.volumes = volumes
+    return volumes
+
+
 class TestReconstruction:
     def test_no_volumes(self):
         parser = ImageParser()
@@ -14,27 +27,13 @@ class TestReconstruction:
 
     def test_no_root(self):
         parser = ImageParser()
-        disk = parser.add_disk("...")
-        v1 = Volume(disk)
-        v1.filesystem.mountpoint = 'xxx'
-        v1.info['lastmountpoint'] = '/etc/x'
-        v2 = Volume(disk)
-        v2.filesystem.mountpoint = 'xxx'
-        v2.info['lastmountpoint'] = '/etc'
-        disk.volumes.volumes = [v1, v2]
+        add_volumes(parser.add_disk("..."), '/etc/x', '/etc')
         with pytest.raises(NoRootFoundError):
             parser.reconstruct()
 
     def test_simple(self, mocker):
         parser = ImageParser()
-        disk = parser.add_disk("...")
-        v1 = Volume(disk)
-        v1.filesystem.mountpoint = 'xxx'
-        v1.info['lastmountpoint'] = '/'
-        v2 = Volume(disk)
-        v2.filesystem.mountpoint = 'xxx'
-        v2.info['lastmountpoint'] = '/etc'
-        disk.volumes.volumes = [v1, v2]
+        v1, v2 = add_volumes(parser.add_disk("..."), '/', '/etc')
 
         v2_bm = mocker.patch.object(v2, "bindmount")
         parser.reconstruct()
@@ -42,20 +41,7 @@ class TestReconstruction:
 
     def test_multiple_roots(self, mocker):
         parser = ImageParser()
-        disk = parser.add_disk("...")
-        v1 = Volume(disk)
-        v1.index = '1'
-        v1.filesystem.mountpoint = 'xxx'
-        v1.info['lastmountpoint'] = '/'
-        v2 = Volume(disk)
-        v2.index = '2'
-        v2.filesystem.mountpoint = 'xxx'
-        v2.info['lastmountpoint'] = '/'
-        v3 = Volume(disk)
-        v3.index = '3'
-        v3.filesystem.mountpoint = 'xxx'
-        v3.info['lastmountpoint'] = '/etc'
-        disk.volumes.volumes = [v1, v2, v3]
+        v1, v2, v3 = add_volumes(parser.add_disk("..."), '/', '/', '/etc')
 
         v1_bm = mocker.patch.object(v1, "bindmount")
         v2_bm = mocker.patch.object(v2, "bindmount")
@@ -64,3 +50,31 @@ class TestReconstruction:
         v1_bm.assert_not_called()
         v2_bm.assert_not_called()
         v3_bm.assert_called_with('xxx/etc')
+
+    def test_nested_mountpoints(self, mocker):
+        parser = ImageParser()
+        v1, v2, v3 = add_volumes(parser.add_disk("..."), '/home/user', '/home', '/')
+
+        manager = mocker.Mock()
+        mocker.patch.object(v1, "bindmount", manager.v1)
+        mocker.patch.object(v2, "bindmount", manager.v2)
+        assert parser.reconstruct() is v3
+        assert manager.mock_calls == [mocker.call.v2('xxx/home'), mocker.call.v1('xxx/home/user')]
+
+
+class TestContextManager:
+    def test_cleans_on_exit(self, mocker):
+        parser = ImageParser()
+        force_clean = mocker.patch.object(parser, "force_clean")
+        with parser as p:
+            assert p is parser
+            force_clean.assert_not_called()
+        force_clean.assert_called_once_with()
+
+    def test_cleans_on_error(self, mocker):
+        parser = ImageParser()
+        force_clean = mocker.patch.object(parser, "force_clean")
+        with pytest.raises(ValueError):
+            with parser:
+                raise ValueError()
+        force_clean.assert_called_once_with()
@@ -1,8 +1,7 @@
-import sys
-
 from imagemounter._util import check_output_
 from imagemounter.disk import Disk
 from imagemounter.parser import ImageParser
+from imagemounter.volume import Volume
 
 
 class TestParted:
@@ -11,8 +10,7 @@ class TestParted:
         def modified_command(cmd, *args, **kwargs):
             if cmd[0] == 'parted':
                 # A command that requests user input
-                return check_output_([sys.executable, "-c", "exec(\"try: input('>> ')\\nexcept: pass\")"],
-                                     *args, **kwargs)
+                return check_output_(['sh', '-c', 'read line || true'], *args, **kwargs)
             return mocker.DEFAULT
         check_output.side_effect = modified_command
 
@@ -21,3 +19,33 @@ class TestParted:
         list(disk.volumes.detect_volumes(method='parted'))
         check_output.assert_called()
         # TODO: kill process when test fails
+
+
+class TestLvm:
+    def test_lvdisplay_parsing(self, mocker):
+        check_output = mocker.patch("imagemounter.volume_system._util.check_output_")
+        check_output.return_value = """  --- Logical volume ---
+  LV Path                /dev/vg0/root
+  LV Name                root
+  VG Name                vg0
+  LV Status              available
+  LV Size                <4,50 GiB
+  Current LE             1151
+
+  --- Logical volume ---
+  LV Path                /dev/vg0/swap
+  LV Name                swap
+  VG Name                vg0
+  LV Size                512.00 MiB
+"""
+        mocker.patch("imagemounter.dependencies._util.command_exists", return_value=True)
+
+        volume = Volume(disk=Disk(ImageParser(), path="..."), index="2")
+        volume.info['volume_group'] = 'vg0'
+        volumes = list(volume.volumes.detect_volumes('lvm', 'lvm'))
+
+        assert [v.index for v in volumes] == ['2.0', '2.1']
+        assert [v.info['label'] for v in volumes] == ['root', 'swap']
+        assert [v._real_path for v in volumes] == ['/dev/vg0/root', '/dev/vg0/swap']
+        assert [v.size for v in volumes] == [int(4.5 * 1024 ** 3), 512 * 1024 ** 2]
+        assert all(v.info['fsdescription'] == 'Logical Volume' for v in volumes)
@@ -1,24 +1,39 @@
+import concurrent.futures
 import io
 import subprocess
-import sys
-import time
+import threading
 
 import pytest
 
-from imagemounter import FILE_SYSTEM_TYPES
+from imagemounter import FILE_SYSTEM_TYPES, filesystems
 from imagemounter.disk import Disk
+from imagemounter.exceptions import SubsystemError
 from imagemounter.filesystems import UnknownFileSystem
 from imagemounter.parser import ImageParser
 from imagemounter.volume import Volume
 
 
 def test_key_material_read():
-    volume = Volume(disk=Disk(ImageParser(keys={'3': 'hello'}), "..."), index='3')
-    assert volume.key == "hello"
-    volume = Volume(disk=Disk(ImageParser(keys={'3': 'hello', '*': 'ola'}), "..."), index='2')
-    assert volume.key == "ola"
-    volume = Volume(disk=Disk(ImageParser(keys={'3': 'hello'}), "..."), index='1')
-    assert volume.key == ""
+    disk = Disk(ImageParser(keys={'3': 'hello'}), "...")
+    assert Volume(disk=disk, index='3').key == "hello"
+    assert Volume(disk=disk, index='1').key == ""
+    disk = Disk(ImageParser(keys={'3': 'hello', '*': 'ola'}), "...")
+    assert Volume(disk=disk, index='2').key == "ola"
+
+
+@pytest.fixture(scope="module")
+def disk():
+    """A disk shared by the volume fixtures. A Volume only reads from its disk and parser, so this is safe."""
+    return Disk(ImageParser(), "...")
+
+
+@pytest.fixture
+def volume(disk, mocker):
+    """A volume on which the blkid and file magic probes find nothing."""
+    volume = Volume(disk=disk)
+    volume._get_blkid_type = mocker.Mock(return_value=None)
+    volume._get_magic_type = mocker.Mock(return_value=None)
+    return volume
 
 
 class TestFsType:
@@ -33,6 +48,17 @@ class TestFsType:
         assert volume.volumes.vstype == "dos"
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES["volumesystem"]
 
+    def test_detect_all_cache(self):
+        filesystems._detect_all_cached.cache_clear()
+        result = filesystems.detect_all('blkid', 'ext4')
+        assert result[FILE_SYSTEM_TYPES['ext']] == 70
+        with pytest.raises(TypeError):
+            result[FILE_SYSTEM_TYPES['ext']] = 0
+
+        # magic output is nearly unique per volume, so it is not worth caching
+        filesystems.detect_all('magic', 'Linux rev 1.0 ext4 filesystem data, UUID=0bdf1bbb')
+        assert filesystems._detect_all_cached.cache_info().currsize == 1
+
     # Add names in here that are shown in the wild for output of mmls / gparted
     # !! Always try to add it also to test_combination
     @pytest.mark.parametrize("description,fstype", [
@@ -49,10 +75,7 @@ class TestFsType:
         ('BSD/386, 386BSD, NetBSD, FreeBSD (0xa5)', 'volumesystem'),
         ('DOS FAT16', 'fat'),
     ])
-    def test_fsdescription(self, description, fstype, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_fsdescription(self, description, fstype, volume):
         self.fstype = ""  # prevent fallback to unknown by default
         volume.info['fsdescription'] = description
         volume.determine_fs_type()
@@ -67,11 +90,9 @@ class TestFsType:
         ('E6D6D379-F507-44C2-A23C-238F2A3DF928', 'lvm'),
         ('79D3D6E6-07F5-C244-A23C-238F2A3DF928', 'lvm'),
         ('CA7D7CCB-63ED-4C53-861C-1742536059CC', 'luks'),
+        ('ca7d7ccb-63ed-4c53-861c-1742536059cc', 'luks'),
     ])
-    def test_guid(self, description, fstype, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_guid(self, description, fstype, volume):
         volume.info['guid'] = description
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES[fstype]
@@ -91,10 +112,8 @@ class TestFsType:
 
         ('dos', 'volumesystem'),
     ])
-    def test_blkid(self, description, fstype, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=description)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_blkid(self, description, fstype, volume):
+        volume._get_blkid_type.return_value = description
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES[fstype]
 
@@ -118,11 +137,11 @@ class TestFsType:
          'number 04e8742c12a96cecd; contains Microsoft Windows XP/VISTA bootloader BOOTMGR', "ntfs"),
 
         ('Squashfs filesystem, little endian, version 4.0', 'squashfs'),
+        ('Macintosh HFS data, block size: 512, number of blocks: 20480', 'hfs'),
+        ('Macintosh HFS+ Extended version 4 data, last mounted by: 10.0', 'hfs+'),
     ])
-    def test_magic(self, description, fstype, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=description)
+    def test_magic(self, description, fstype, volume):
+        volume._get_magic_type.return_value = description
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES[fstype]
 
@@ -145,40 +164,29 @@ class TestFsType:
         ({"fsdescription": "BSD/386, 386BSD, NetBSD, FreeBSD (0xa5)", "blkid": "ufs"}, "volumesystem"),
         ({"fsdescription": "4.2BSD (0x07)", "blkid": "ufs"}, "ufs"),
     ])
-    def test_combination(self, definition, fstype, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=definition.get("blkid"))
-        volume._get_magic_type = mocker.Mock(return_value=definition.get("magic"))
+    def test_combination(self, definition, fstype, volume):
+        volume._get_blkid_type.return_value = definition.get("blkid")
+        volume._get_magic_type.return_value = definition.get("magic")
         volume.info = definition
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES[fstype]
 
-    def test_no_clue_fstype(self, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_no_clue_fstype(self, volume):
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is UnknownFileSystem 
 
-    def test_little_clue_fstype(self, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value="-")
-        volume._get_magic_type = mocker.Mock(return_value="-")
+    def test_little_clue_fstype(self, volume):
+        volume._get_blkid_type.return_value = "-"
+        volume._get_magic_type.return_value = "-"
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is UnknownFileSystem
 
-    def test_fstype_fallback(self, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_fstype_fallback(self, volume):
         volume._get_fstype_from_parser('?ufs')
         volume.determine_fs_type()
         assert volume.filesystem.__class__ is FILE_SYSTEM_TYPES["ufs"]
 
-    def test_fstype_fallback_unknown(self, mocker):
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume._get_blkid_type = mocker.Mock(return_value=None)
-        volume._get_magic_type = mocker.Mock(return_value=None)
+    def test_fstype_fallback_unknown(self, volume):
         volume.info['fsdescription'] = "Linux (0x83)"
 
         # If something more specific is set, we use that
@@ -202,6 +210,28 @@ class TestFileMagic:
         assert volume._get_magic_type() is None
 
 
+def mock_fsstat(mocker, output, blocking=False):
+    """Patches Popen to let fsstat return the provided output. Every read of stdout starts at the beginning.
+
+    If *blocking* is True, reading stdout blocks until the process is terminated, like a slow fsstat would.
+    """
+    mock_popen = mocker.patch('subprocess.Popen')
+    terminated = threading.Event()
+
+    def stdout():
+        if blocking:
+            # the timeout guards against hanging the test suite
+            terminated.wait(5)
+        return io.BytesIO(output)
+
+    type(mock_popen()).stdout = mocker.PropertyMock(side_effect=stdout)
+    mock_popen().terminate.side_effect = terminated.set
+
+    volume = Volume(disk=Disk(ImageParser(), "..."))
+    volume.get_raw_path = mocker.Mock(return_value="...")
+    return mock_popen, volume
+
+
 class TestFsstat:
     def test_ext4(self, mocker):
         # Removed some items from this output as we don't use it in its entirety anyway
@@ -222,11 +252,7 @@ Source OS: Linux
 
 BLOCK GROUP INFORMATION
 --------------------------------------------"""
-        mock_popen = mocker.patch('subprocess.Popen')
-        type(mock_popen()).stdout = mocker.PropertyMock(return_value=io.BytesIO(result))
-
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume.get_raw_path = mocker.Mock(return_value="...")
+        mock_popen, volume = mock_fsstat(mocker, result)
 
         volume._load_fsstat_data()
 
@@ -246,11 +272,7 @@ File System Type: NTFS
 Volume Serial Number: 4E8742C12A96CECD
 OEM Name: NTFS    
 Version: Windows XP"""
-        mock_popen = mocker.patch('subprocess.Popen')
-        type(mock_popen()).stdout = mocker.PropertyMock(return_value=io.BytesIO(result))
-
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume.get_raw_path = mocker.Mock(return_value="...")
+        _, volume = mock_fsstat(mocker, result)
 
         volume._load_fsstat_data()
 
@@ -266,30 +288,149 @@ Version: Windows XP"""
 File System Type: Ext4
 Volume Name: \xd0\xa0\xd0\xbe\xd1\x81\xd1\x81\xd0\xb8\xd0\xb8
 Volume ID: 2697f5b0479b15b1b4c81994387cdba"""
-        mock_popen = mocker.patch('subprocess.Popen')
-        type(mock_popen()).stdout = mocker.PropertyMock(return_value=io.BytesIO(result))
-
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume.get_raw_path = mocker.Mock(return_value="...")
+        _, volume = mock_fsstat(mocker, result)
 
         volume._load_fsstat_data()
 
         assert volume.info['statfstype'] == 'Ext4'
         assert volume.info['label'] == u'\u0420\u043e\u0441\u0441\u0438\u0438'
 
+    def test_non_utf8_label(self, mocker):
+        result = b"""FILE SYSTEM INFORMATION
+--------------------------------------------
+File System Type: Ext4
+Volume Name: caf\xe9
+Last mounted on: /data"""
+        _, volume = mock_fsstat(mocker, result)
+
+        volume._load_fsstat_data()
+
+        assert volume.info['lastmountpoint'] == '/data'
+        assert volume.info['label'] == u'/data (caf\ufffd)'
+
     def test_killed_after_timeout(self, mocker):
-        def mock_side_effect(*args, **kwargs):
-            time.sleep(0.2)
-            return io.BytesIO(b"")
+        mock_popen, volume = mock_fsstat(mocker, b"", blocking=True)
 
-        mock_popen = mocker.patch('subprocess.Popen')
-        type(mock_popen()).stdout = mocker.PropertyMock(side_effect=mock_side_effect)
+        volume._load_fsstat_data(timeout=0.01)
+        mock_popen().terminate.assert_called()
 
-        volume = Volume(disk=Disk(ImageParser(), "..."))
-        volume.get_raw_path = mocker.Mock(return_value="...")
+    def test_killed_after_timeout_when_pool_busy(self, mocker):
+        mock_popen, volume = mock_fsstat(mocker, b"", blocking=True)
 
-        volume._load_fsstat_data(timeout=0.1)
+        # keep the only worker busy for longer than the timeout, which must only start counting once fsstat runs
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        mocker.patch("imagemounter.volume._stats_pool", pool)
+        pool.submit(threading.Event().wait, 0.05)
+
+        volume._load_fsstat_data(timeout=0.01)
         mock_popen().terminate.assert_called()
+        pool.shutdown()
+
+
+class TestPrefetch:
+    def test_mount_uses_prefetched_data(self, mocker):
+        disk = Disk(ImageParser(), "...")
+        disk.is_mounted = True
+        volume = Volume(disk=disk, fstype='ext', index='1', parent=disk)
+        load_fsstat_data = mocker.patch.object(volume, "_load_fsstat_data")
+        filesystem_mount = mocker.patch.object(volume.filesystem, "mount")
+
+        volume.prefetch()
+        volume.mount()
+
+        load_fsstat_data.assert_called_once_with()
+        filesystem_mount.assert_called_once_with()
+        assert volume.is_mounted
+
+    def test_not_prefetched_when_skipped(self, mocker):
+        disk = Disk(ImageParser(), "...")
+        disk.is_mounted = True
+        volume = Volume(disk=disk, fstype='ext', index='1', parent=disk)
+        load_fsstat_data = mocker.patch.object(volume, "_load_fsstat_data")
+
+        volume.prefetch(skip_mount=['1'])
+        volume.flag = 'unalloc'
+        volume.prefetch()
+
+        load_fsstat_data.assert_not_called()
+
+    def test_prefetch_cancelled_on_unmount(self, mocker):
+        disk = Disk(ImageParser(), "...")
+        disk.is_mounted = True
+        volume = Volume(disk=disk, fstype='ext', index='1', parent=disk)
+        load_fsstat_data = mocker.patch.object(volume, "_load_fsstat_data")
+        mocker.patch.object(volume.filesystem, "unmount")
+
+        # keep the only worker busy, so prefetching this volume is still queued when it is unmounted
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        mocker.patch("imagemounter.volume._prefetch_pool", pool)
+        busy = threading.Event()
+        pool.submit(busy.wait, 5)
+
+        volume.prefetch()
+        prefetched = volume._prefetched
+        volume.unmount()
+        busy.set()
+        pool.shutdown()
+
+        assert prefetched.cancelled()
+        assert volume._prefetched is None
+        load_fsstat_data.assert_not_called()
+
+    def test_skip_decided_before_prefetch(self, mocker):
+        disk = Disk(ImageParser(), "...")
+        disk.is_mounted = True
+        volume = Volume(disk=disk, fstype='ext', index='1', parent=disk)
+        mocker.patch.object(volume, "_load_fsstat_data",
+                            side_effect=lambda: volume.info.update(label='/home', lastmountpoint='/home'))
+        filesystem_mount = mocker.patch.object(volume.filesystem, "mount")
+        mocker.patch.object(volume, "detect_mountpoint")
+
+        volume.prefetch(skip_mount=['/home'])
+        volume._prefetched.result()  # fsstat has now reported a label that is skipped
+        assert list(volume.init(skip_mount=['/home'])) == [volume]
+
+        filesystem_mount.assert_called_once_with()
+
+
+class TestLvm:
+    @pytest.mark.parametrize("pvscan", [
+        "  PV /dev/loop0   VG vg0   lvm2 [<5,00 GiB / 0    free]\n",
+        "  PV /dev/loop0    is in exported VG vg0 [<5,00 GiB / 0    free]\n",
+    ])
+    def test_volume_group_from_pvscan(self, pvscan, mocker):
+        mocker.patch("imagemounter.dependencies._util.command_exists", return_value=True)
+        mocker.patch("imagemounter.filesystems.time.sleep")
+        mocker.patch("imagemounter.filesystems._util.check_output_", return_value=(
+            "  PV /dev/loop1   VG other   lvm2 [1,00 GiB / 0    free]\n" + pvscan +
+            "  Total: 2 [<6,00 GiB] / in use: 2 [<6,00 GiB] / in no VG: 0 [0   ]\n"))
+        check_call = mocker.patch("imagemounter.filesystems._util.check_call_")
+
+        volume = Volume(disk=Disk(ImageParser(), "..."), fstype='lvm')
+        volume.get_raw_path = mocker.Mock(return_value="/tmp/image.dd")
+        mocker.patch.object(volume.filesystem, "_find_loopback",
+                            side_effect=lambda: setattr(volume.filesystem, 'loopback', '/dev/loop0'))
+        mocker.patch.object(volume.volumes, "detect_volumes", return_value=[])
+
+        volume.filesystem.mount()
+        assert volume.filesystem.vgname == 'vg0'
+        check_call.assert_called_with(["lvm", "vgchange", "-a", "y", "vg0"], stdout=mocker.ANY)
+
+
+class TestVss:
+    def test_mountpoint_cleared_on_failure(self, mocker):
+        mocker.patch("imagemounter.dependencies._util.command_exists", return_value=True)
+        mocker.patch("imagemounter.filesystems._util.check_call_",
+                     side_effect=subprocess.CalledProcessError(1, 'vshadowmount'))
+
+        volume = Volume(disk=Disk(ImageParser(), "..."), fstype='vss-container')
+        volume.get_raw_path = mocker.Mock(return_value="/tmp/image.dd")
+        made = mocker.spy(volume.filesystem, "_make_mountpoint")
+
+        with pytest.raises(SubsystemError):
+            volume.filesystem.mount()
+        made.assert_called_once_with(casename=None, suffix='vss')
+        assert volume.filesystem.mountpoint is None
 
 
 class TestLuks:
@@ -300,25 +441,19 @@ class TestLuks:
                 return True
             if cmd[0:1] == ['losetup']:
                 return "/dev/loop0"
-            return mock.DEFAULT
+            return mocker.DEFAULT
         check_call.side_effect = modified_check_call
 
         check_output = mocker.patch("imagemounter.volume._util.check_output_")
         def modified_check_output(cmd, *args, **kwargs):
             if cmd[0:1] == ['losetup']:
                 return "/dev/loop0"
-            return mock.DEFAULT
+            return mocker.DEFAULT
         check_output.side_effect = modified_check_output
 
-        original_popen = subprocess.Popen
-        def modified_popen(cmd, *args, **kwargs):
-            if cmd[0:3] == ['cryptsetup', '-r', 'luksOpen']:
-                # A command that requests user input
-                x = original_popen([sys.executable, "-c", "print(input(''))"],
-                                   *args, **kwargs)
-                return x
-            return mock.DEFAULT
-        popen = mocker.patch("subprocess.Popen", side_effect=modified_popen)
+        # cryptsetup reads the key from stdin
+        run = mocker.patch("imagemounter.filesystems.subprocess.run")
+        run.return_value.returncode = 0
 
         disk = Disk(ImageParser(keys={'1': 'p:passphrase'}), "...")
         disk.is_mounted = True
@@ -328,3 +463,5 @@ class TestLuks:
         assert volume.is_mounted
         assert len(volume.volumes) == 1
         assert volume.volumes[0].info['fsdescription'] == "LUKS Volume"
+        run.assert_called_once_with(['cryptsetup', '-r', 'luksOpen', mocker.ANY, mocker.ANY], input=b"passphrase",
+                                    stdout=mocker.ANY, stderr=mocker.ANY)